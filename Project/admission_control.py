@@ -0,0 +1,367 @@
+"""
+admission_control.py
+
+Admission control for the iris login endpoints:
+- Token buckets per account and per client address (429 + Retry-After when empty)
+- Global limit on in-flight verifications, with a short bounded wait queue;
+  anything beyond that is shed immediately with 503
+- Adaptive refill: buckets refill slower as the verification slots fill up
+- Counters (admitted, rejections, in-flight, queue depth) for the stats page
+- State lives in a backend: MemoryBackend for a single process, RedisBackend
+  so several workers share buckets, slots, the wait queue and counters
+"""
+
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+RATE_LIMITED = 429
+OVERLOADED = 503
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ------------------------------------------------------------------------------
+# Backends
+#
+# consume(key, rate, capacity) -> 0 or seconds until a token is available
+# try_acquire_slot(limit)      -> slot token, or None when all slots are taken
+# wait_for_slot(limit, timeout)-> like try_acquire_slot, blocking up to timeout
+# enter_queue(limit, timeout)  -> waiter token, or None when the queue is full
+# release_slot(token), leave_queue(token), in_flight(), queue_depth(),
+# incr(name, amount), get_counters()
+# ------------------------------------------------------------------------------
+
+class MemoryBackend:
+    """Process-local state guarded by one lock.
+
+    Buckets that have refilled completely are indistinguishable from new ones,
+    so they are dropped on a periodic sweep; ``max_buckets`` caps the table in
+    between (least recently used first), so random usernames or addresses
+    cannot grow it without bound.
+    """
+
+    def __init__(self, max_buckets=10000, sweep_interval=10.0, clock=time.monotonic):
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.buckets = OrderedDict()   # key -> [tokens, last_refill, rate, capacity]
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        self.clock = clock             # bucket refill time source, replaceable in tests
+        self.last_sweep = clock()
+        self.slots = 0
+        self.waiting = 0
+        self.counters = {}
+
+    def _sweep(self, now):
+        # caller holds the lock
+        full = [key for key, (tokens, last, rate, capacity) in self.buckets.items()
+                if tokens + (now - last) * rate >= capacity]
+        for key in full:
+            del self.buckets[key]
+        self.last_sweep = now
+
+    def consume(self, key, rate, capacity):
+        # Returns 0 when a token was taken, otherwise seconds until one is available
+        now = self.clock()
+        with self.lock:
+            if now - self.last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            tokens, last = self.buckets.pop(key, (capacity, now))[:2]
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = [tokens, now, rate, capacity]
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def try_acquire_slot(self, limit):
+        with self.lock:
+            return self._take_slot(limit)
+
+    def _take_slot(self, limit):
+        # caller holds the lock
+        if self.slots >= limit:
+            return None
+        self.slots += 1
+        return True
+
+    def wait_for_slot(self, limit, timeout):
+        deadline = time.monotonic() + timeout
+        with self.slot_freed:
+            while True:
+                token = self._take_slot(limit)
+                remaining = deadline - time.monotonic()
+                if token or remaining <= 0:
+                    return token
+                self.slot_freed.wait(remaining)
+
+    def release_slot(self, token):
+        with self.slot_freed:
+            self.slots = max(0, self.slots - 1)
+            self.slot_freed.notify()
+
+    def enter_queue(self, limit, timeout):
+        with self.lock:
+            if self.waiting >= limit:
+                return None
+            self.waiting += 1
+            return True
+
+    def leave_queue(self, token):
+        with self.lock:
+            self.waiting = max(0, self.waiting - 1)
+
+    def in_flight(self):
+        with self.lock:
+            return self.slots
+
+    def queue_depth(self):
+        with self.lock:
+            return self.waiting
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_counters(self):
+        with self.lock:
+            counters = dict(self.counters)
+            counters['in_flight'] = self.slots
+            counters['queue_depth'] = self.waiting
+            counters['buckets'] = len(self.buckets)
+        return counters
+
+
+class RedisBackend:
+    """Shared state in Redis, so every worker process enforces the same limits.
+
+    Needs the 'redis' package. Each held slot and each queued waiter is a
+    member of a sorted set scored by its own deadline (slots: ``slot_ttl``,
+    waiters: their queue timeout plus a second); expired members are dropped
+    before counting, so whatever a dead worker held frees itself and live
+    entries are never lost. Verifications must finish within ``slot_ttl``.
+    All timestamps, bucket refills included, come from Redis TIME, so clock
+    skew between workers does not matter. Waiting for a slot polls with
+    exponential backoff between ``backoff`` and ``max_backoff`` seconds.
+    """
+
+    CONSUME_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+    local tokens = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    ADD_MEMBER_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then return 0 end
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+    return 1
+    """
+
+    COUNT_SCRIPT = """
+    local t = redis.call('TIME')
+    return redis.call('ZCOUNT', KEYS[1], tonumber(t[1]) + tonumber(t[2]) / 1000000, '+inf')
+    """
+
+    def __init__(self, url, prefix='iris:admission:', slot_ttl=60, backoff=0.02, max_backoff=0.25):
+        import redis  # optional dependency, only needed for multi-worker deployments
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.slot_ttl = slot_ttl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slots_key = prefix + 'slots'
+        self.queue_key = prefix + 'queue'
+        self.counters_key = prefix + 'counters'
+        self._consume = self.client.register_script(self.CONSUME_SCRIPT)
+        self._add_member = self.client.register_script(self.ADD_MEMBER_SCRIPT)
+        self._count = self.client.register_script(self.COUNT_SCRIPT)
+
+    def consume(self, key, rate, capacity):
+        return float(self._consume(keys=[self.prefix + 'bucket:' + key], args=[rate, capacity]))
+
+    def _add(self, key, limit, ttl):
+        token = uuid.uuid4().hex
+        if self._add_member(keys=[key], args=[limit, ttl, token]):
+            return token
+        return None
+
+    def try_acquire_slot(self, limit):
+        return self._add(self.slots_key, limit, self.slot_ttl)
+
+    def enter_queue(self, limit, timeout):
+        return self._add(self.queue_key, limit, timeout + 1)
+
+    def leave_queue(self, token):
+        self.client.zrem(self.queue_key, token)
+
+    def wait_for_slot(self, limit, timeout):
+        deadline = time.monotonic() + timeout
+        delay = self.backoff
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            token = self.try_acquire_slot(limit)
+            if token:
+                return token
+            delay = min(delay * 2, self.max_backoff)
+
+    def release_slot(self, token):
+        self.client.zrem(self.slots_key, token)
+
+    def in_flight(self):
+        return int(self._count(keys=[self.slots_key]))
+
+    def queue_depth(self):
+        return int(self._count(keys=[self.queue_key]))
+
+    def incr(self, name, amount=1):
+        self.client.hincrby(self.counters_key, name, amount)
+
+    def get_counters(self):
+        raw = self.client.hgetall(self.counters_key)
+        counters = {k.decode(): int(v) for k, v in raw.items()}
+        counters['in_flight'] = self.in_flight()
+        counters['queue_depth'] = self.queue_depth()
+        return counters
+
+
+# ------------------------------------------------------------------------------
+# Controller
+# ------------------------------------------------------------------------------
+
+class AdmissionController:
+    """Decides whether a login attempt may start verification.
+
+    user_rate / client_rate are tokens per second, *_burst the bucket sizes;
+    'user' and 'admin' account buckets both use the user settings.
+    While verifications are in flight the refill rate is scaled by the free
+    fraction of max_in_flight (never below min_rate_factor), so sustained
+    bursts are throttled harder exactly when the server is busy.
+    """
+
+    def __init__(self, backend=None, user_rate=0.2, user_burst=5,
+                 client_rate=1.0, client_burst=10, max_in_flight=4,
+                 max_queue=8, queue_timeout=2.0, min_rate_factor=0.25):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.min_rate_factor = min_rate_factor
+
+    def _rate_factor(self):
+        busy = self.backend.in_flight() / float(self.max_in_flight)
+        return max(self.min_rate_factor, 1.0 - busy)
+
+    def check_rate(self, kind, key):
+        if kind in ('user', 'admin'):
+            rate, burst = self.user_rate, self.user_burst
+        else:
+            rate, burst = self.client_rate, self.client_burst
+        wait = self.backend.consume(f"{kind}:{key}", rate * self._rate_factor(), burst)
+        if wait > 0:
+            self.backend.incr(f"rejected_{kind}_rate")
+            raise AdmissionRejected(RATE_LIMITED, f"Too many login attempts for this {kind}.", wait)
+
+    def acquire(self):
+        """Take a verification slot and return its token (pass it to release)."""
+        token = self.backend.try_acquire_slot(self.max_in_flight)
+        if token:
+            return token
+        # max_queue counts waiters in every worker sharing the backend
+        waiter = self.backend.enter_queue(self.max_queue, self.queue_timeout)
+        if not waiter:
+            self.backend.incr('rejected_overload')
+            raise AdmissionRejected(OVERLOADED, "Server busy, try again shortly.", self.queue_timeout)
+        self.backend.incr('queued_total')
+        try:
+            token = self.backend.wait_for_slot(self.max_in_flight, self.queue_timeout)
+            if token:
+                return token
+            self.backend.incr('rejected_queue_timeout')
+            raise AdmissionRejected(OVERLOADED, "Server busy, try again shortly.", self.queue_timeout)
+        finally:
+            self.backend.leave_queue(waiter)
+
+    def release(self, token):
+        self.backend.release_slot(token)
+
+    def stats(self):
+        counters = self.backend.get_counters()
+        counters['max_in_flight'] = self.max_in_flight
+        counters['max_queue'] = self.max_queue
+        return counters
+
+    def guard(self, client_key, account_key, account_kind='user', methods=('POST',)):
+        """Decorator for a Flask view.
+
+        client_key() runs before the request body is read. account_key() may
+        parse the multipart form and should return None for unknown users, so
+        made-up names never get a bucket. Its bucket is named
+        '<account_kind>:<key>', so e.g. kind 'admin' can never collide with a
+        user account. Both rate limits are checked before a verification slot
+        is taken, so attempts that would be refused anyway never occupy the
+        queue. Rejections are passed to on_reject(exc), which returns the
+        response.
+
+        An account bucket is shared by every client: anyone who can reach the
+        endpoint can drain it and so lock that account out. That is the
+        intended trade-off against brute force, but for a single fixed account
+        (the admin login) it means a remote client can hold it locked.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import request
+                if request.method not in methods:
+                    return view(*args, **kwargs)
+                try:
+                    self.check_rate('client', client_key())
+                    account = account_key()
+                    if account:
+                        self.check_rate(account_kind, account)
+                    token = self.acquire()
+                except AdmissionRejected as exc:
+                    return self.on_reject(exc)
+                try:
+                    self.backend.incr('admitted')
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(token)
+            return wrapper
+        return decorator
+
+    def on_reject(self, exc):
+        retry = max(1, int(round(exc.retry_after)))
+        html = f"<html><body><h4>{exc.reason}</h4><p>Retry in {retry} s.</p></body></html>"
+        return html, exc.status, {'Retry-After': str(retry)}
@@ -8,6 +8,8 @@ A single-file Python application that:
 - Safe file delete (PermissionError)
 - Full exit with short delay
 - All routes return valid responses
+- Multi-file upload and streamed zip download of a user's files
+- Admission control (rate limits + concurrency cap) on the login endpoints
 """
 
 import os
@@ -16,15 +18,18 @@ import threading
 import uuid
 import time
 import sys
+import zipfile
 
 import webview
 from flask import (
     Flask, request, redirect, url_for, render_template_string,
-    session, flash, send_from_directory, abort
+    session, flash, send_from_directory, abort, Response, stream_with_context
 )
 from werkzeug.utils import secure_filename
 from docx2pdf import convert
 
+from admission_control import AdmissionController, MemoryBackend, RedisBackend
+
 print("DEBUG: Starting iris_app.py...")
 
 app = Flask(__name__)
@@ -41,6 +46,25 @@ ADMIN_USERNAME = 'admin'
 ADMIN_PASSWORD = 'admin123'
 ADMIN_IRIS_PATH = 'admin_iris.jpg'  # For admin's iris check
 
+# Login admission control. Set IRIS_ADMISSION_REDIS_URL to share limits across worker processes.
+ADMISSION_REDIS_URL = os.environ.get('IRIS_ADMISSION_REDIS_URL')
+admission = AdmissionController(
+    backend=RedisBackend(ADMISSION_REDIS_URL) if ADMISSION_REDIS_URL else MemoryBackend(),
+    user_rate=0.2, user_burst=5,        # per username: 5 tries, then one every 5 s
+    client_rate=1.0, client_burst=10,   # per client address
+    max_in_flight=4, max_queue=8, queue_timeout=2.0
+)
+# The admin login has a single 'admin:login' bucket shared by all clients, so a
+# remote client can keep it drained (a lockout); the client bucket still applies.
+
+def login_client_key():
+    return request.remote_addr or 'unknown'
+
+def login_username_key():
+    # Only real accounts get a bucket; unknown names are refused cheaply by the view
+    username = request.form.get('username')
+    return username if username in USERS else None
+
 def load_users_from_json():
     global USERS
     if os.path.exists(USER_DATA_FILE):
@@ -335,11 +359,11 @@ USER_DASHBOARD_TEMPLATE = """
   <div class="dashboard-container">
     <h2>User Dashboard</h2>
     <div class="mb-4">
-      <h5>Upload File</h5>
+      <h5>Upload Files</h5>
       <form method="post" action="{{ url_for('user_upload_file') }}" enctype="multipart/form-data">
         <div class="mb-3">
-          <label>Select File:</label>
-          <input type="file" name="file" class="form-control" required>
+          <label>Select Files:</label>
+          <input type="file" name="file" class="form-control" multiple required>
         </div>
         <button class="btn btn-success">Upload</button>
       </form>
@@ -347,13 +371,15 @@ USER_DASHBOARD_TEMPLATE = """
 
     <div class="mb-4">
       <h5>Your Files</h5>
+      <form id="download-form" method="post" action="{{ url_for('download_files') }}"></form>
       <table class="table table-bordered">
         <thead>
-          <tr><th>Filename</th><th>Size(bytes)</th><th>Actions</th></tr>
+          <tr><th></th><th>Filename</th><th>Size(bytes)</th><th>Actions</th></tr>
         </thead>
         <tbody>
           {% for file_info in user_data.files %}
           <tr>
+            <td><input type="checkbox" name="filenames" value="{{ file_info[0] }}" form="download-form"></td>
             <td>{{ file_info[0] }}</td>
             <td>{{ file_info[1] }}</td>
             <td>
@@ -368,6 +394,10 @@ USER_DASHBOARD_TEMPLATE = """
           {% endfor %}
         </tbody>
       </table>
+      {% if user_data.files %}
+      <button class="btn btn-primary" type="submit" form="download-form">Download Selected</button>
+      <a class="btn btn-primary" href="{{ url_for('download_files') }}">Download All (.zip)</a>
+      {% endif %}
     </div>
     <form method="post" action="{{ url_for('logout') }}">
       <button class="btn btn-secondary">Logout</button>
@@ -382,6 +412,7 @@ USER_DASHBOARD_TEMPLATE = """
 # 2) FLASK ROUTES
 # ------------------------------------------------------------------------------
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # optional: 100MB upload limit
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read/written per step when streaming zip downloads
 
 @app.route('/', methods=['GET'])
 def main_page():
@@ -399,6 +430,7 @@ def exit_application():
     return "<html><body><h4>Closing application...</h4></body></html>"
 
 @app.route('/admin_login', methods=['GET','POST'])
+@admission.guard(login_client_key, lambda: 'login', account_kind='admin')
 def admin_login():
     if request.method == 'GET':
         return render_template_string(ADMIN_LOGIN_TEMPLATE)
@@ -457,6 +489,13 @@ def add_user():
     flash(f"User '{new_user_username}' added.")
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admission_stats')
+def admission_stats():
+    # Queue depth / rejection counters, JSON for the admin
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('main_page'))
+    return admission.stats()
+
 @app.route('/delete_user', methods=['POST'])
 def delete_user():
     if not session.get('admin_logged_in'):
@@ -472,6 +511,7 @@ def delete_user():
     return redirect(url_for('admin_dashboard'))
 
 @app.route('/user_login', methods=['GET','POST'])
+@admission.guard(login_client_key, login_username_key)
 def user_login():
     if request.method == 'GET':
         return render_template_string(USER_LOGIN_TEMPLATE)
@@ -512,25 +552,110 @@ def user_upload_file():
     if not session.get('user_logged_in'):
         return redirect(url_for('main_page'))
 
-    file = request.files.get('file')
-    if not file:
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+    if not files:
         flash("No file selected!")
         return redirect(url_for('user_dashboard'))
 
     username = session['username']
     user_data = USERS[username]
 
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
-
-    file_size = os.path.getsize(file_path)
-    user_data['files'].append((filename, file_size))
+    # Each file is streamed to disk by werkzeug; users.json is written once for the batch
+    saved = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        if not filename:
+            continue
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(file_path, buffer_size=STREAM_CHUNK_SIZE)
+        file_size = os.path.getsize(file_path)
+        # Re-uploading a name replaces the old entry instead of listing it twice
+        user_data['files'] = [(f, sz) for f, sz in user_data['files'] if f != filename]
+        user_data['files'].append((filename, file_size))
+        saved.append(filename)
+
+    if not saved:
+        flash("No valid file names in upload!")
+        return redirect(url_for('user_dashboard'))
     save_users_to_json()
 
-    flash(f"File '{filename}' uploaded.")
+    if len(saved) == 1:
+        flash(f"File '{saved[0]}' uploaded.")
+    else:
+        flash(f"{len(saved)} files uploaded: {', '.join(saved)}")
     return redirect(url_for('user_dashboard'))
 
+class ZipStreamBuffer:
+    # Write-only file object for zipfile; the generator drains it after every write,
+    # so only one chunk of the archive is held in memory at a time
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(paths):
+    """Yield a zip archive of (arcname, path) pairs piece by piece."""
+    buf = ZipStreamBuffer()
+    # Stored, not deflated: most vault content (images, pdf, docx) is already compressed
+    with zipfile.ZipFile(buf, mode='w', compression=zipfile.ZIP_STORED) as zf:
+        for arcname, path in paths:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield buf.drain()
+            yield buf.drain()
+    yield buf.drain()
+
+@app.route('/download_files', methods=['GET', 'POST'])
+def download_files():
+    # GET => whole vault, POST => only the checked 'filenames'
+    if not session.get('user_logged_in'):
+        return redirect(url_for('main_page'))
+
+    username = session['username']
+    user_data = USERS[username]
+    owned = [f for f, sz in user_data['files']]
+    if request.method == 'POST':
+        wanted = set(request.form.getlist('filenames'))
+        if not wanted:
+            flash("No files selected for download!")
+            return redirect(url_for('user_dashboard'))
+        owned = [f for f in owned if f in wanted]
+
+    paths = []
+    for f in dict.fromkeys(owned):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f)
+        if os.path.exists(path):
+            paths.append((f, path))
+    if not paths:
+        flash("No files available to download.")
+        return redirect(url_for('user_dashboard'))
+
+    resp = Response(stream_with_context(stream_zip(paths)), mimetype='application/zip')
+    resp.headers["Content-Disposition"] = f'attachment; filename="{secure_filename(username)}_files.zip"'
+    resp.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    return resp
+
 @app.route('/view/<filename>')
 def view_file_inline(filename):
     # Ensure user is logged in
@@ -0,0 +1,391 @@
+"""
+iris_segmentation.py
+
+Pupil / limbus boundary localisation for iris images:
+- Daugman-style integro-differential search (mean intensity along circles,
+  largest radial jump wins); pupil edges are weighted by how dark the ring
+  just inside them is, so the limbus cannot pass for the pupil
+- Coarse-to-fine: exhaustive search only on the top pyramid level, which is
+  resampled to a fixed size, then a small local window at every finer level.
+  A tiny pupil looks much like any dark blob on the top level, so the best few
+  pupil candidates are all refined and the full-resolution contrast decides
+- Circle sampling offsets come from cached lookup tables, so no trig is
+  evaluated inside the search loops
+- A brute-force single-level search is kept for comparison and the
+  benchmark (run this file directly, see --help)
+"""
+
+import argparse
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+Circle = namedtuple('Circle', ['x', 'y', 'r'])
+
+COARSE_SIZE = 64            # smaller side of the top pyramid level
+N_ANGLES = 64               # samples per circle
+REFINE_WINDOW = 2           # +/- pixels searched (centre and radius) per finer level
+PUPIL_RADIUS_FRAC = (0.02, 0.25)     # pupil radius, as fraction of the smaller image side
+PUPIL_IRIS_RATIO = (0.1, 0.8)        # pupil radius / iris radius
+CENTER_CHUNK = 4096         # centres scored per vectorised batch
+DARK_BIAS = 10.0            # keeps the pupil score finite for the darkest candidate
+PUPIL_CANDIDATES = 5        # top-level pupil hypotheses carried down the pyramid
+
+FULL_CIRCLE = ((0.0, 360.0),)
+# The pupil edge has to show up in every quadrant, which rules out eye corners and lash clumps
+QUADRANTS = ((-45.0, 45.0), (45.0, 135.0), (135.0, 225.0), (225.0, 315.0))
+# The limbus is only sampled on the left/right arcs, eyelids tend to cover top and bottom
+LATERAL_ARCS = ((-45.0, 45.0), (135.0, 225.0))
+
+
+# ------------------------------------------------------------------------------
+# Image helpers
+# ------------------------------------------------------------------------------
+
+def load_grayscale(path, max_side=None):
+    """Load an image as a float32 grayscale array, optionally downscaled so its
+    longer side is at most ``max_side``."""
+    with Image.open(path) as im:
+        im = im.convert('L')
+        if max_side and max(im.size) > max_side:
+            scale = max_side / float(max(im.size))
+            im = im.resize((max(1, round(im.width * scale)),
+                            max(1, round(im.height * scale))), Image.BILINEAR)
+        return np.asarray(im, dtype=np.float32)
+
+def downsample(image):
+    """Halve both dimensions with a 2x2 box filter."""
+    h, w = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    img = image[:h, :w]
+    return 0.25 * (img[0::2, 0::2] + img[1::2, 0::2] + img[0::2, 1::2] + img[1::2, 1::2])
+
+def resize(image, shape):
+    """Bilinear resample of a float image to (height, width)."""
+    im = Image.fromarray(np.asarray(image, dtype=np.float32))
+    return np.asarray(im.resize((shape[1], shape[0]), Image.BILINEAR), dtype=np.float32)
+
+def build_pyramid(image, coarse_size=COARSE_SIZE):
+    """Return [full resolution, 1/2, 1/4, ..., top]. Levels are halved while
+    the smaller side stays >= ``coarse_size``; the top level is then resampled
+    so its smaller side is exactly ``coarse_size`` (scale step in (1, 2]), which
+    keeps the cost of the exhaustive search independent of the input size."""
+    pyramid = [np.asarray(image, dtype=np.float32)]
+    while min(pyramid[-1].shape) // 2 >= coarse_size:
+        pyramid.append(downsample(pyramid[-1]))
+    h, w = pyramid[-1].shape
+    if min(h, w) > coarse_size:
+        scale = coarse_size / float(min(h, w))
+        shape = (max(coarse_size, round(h * scale)), max(coarse_size, round(w * scale)))
+        pyramid.append(resize(pyramid[-1], shape))
+    return pyramid
+
+
+# ------------------------------------------------------------------------------
+# Circle sampling lookup tables
+# ------------------------------------------------------------------------------
+
+def arc_sizes(n_angles, arcs):
+    """Number of samples given to each arc, proportional to its span."""
+    spans = [hi - lo for lo, hi in arcs]
+    total = float(sum(spans))
+    return [max(1, int(round(n_angles * span / total))) for span in spans]
+
+@lru_cache(maxsize=256)
+def circle_lut(r_min, r_max, n_angles=N_ANGLES, arcs=FULL_CIRCLE):
+    """Integer (dy, dx) offsets for every radius in [r_min, r_max] and
+    ``n_angles`` angles spread over ``arcs`` (degrees). Shapes are (R, A).
+
+    Cached: the refinement stages ask for the same small radius windows over
+    and over, so the tables are built once per process.
+    """
+    angles = [np.linspace(lo, hi, n, endpoint=False)
+              for (lo, hi), n in zip(arcs, arc_sizes(n_angles, arcs))]
+    theta = np.deg2rad(np.concatenate(angles))
+    radii = np.arange(r_min, r_max + 1, dtype=np.float64)[:, None]
+    dy = np.rint(radii * np.sin(theta)).astype(np.intp)
+    dx = np.rint(radii * np.cos(theta)).astype(np.intp)
+    dy.flags.writeable = False
+    dx.flags.writeable = False
+    return dy, dx
+
+
+# ------------------------------------------------------------------------------
+# Integro-differential search
+# ------------------------------------------------------------------------------
+
+def _smooth_radial(profile):
+    # [1, 2, 1] / 4 along the radius axis, edges left as-is
+    out = profile.copy()
+    out[:, 1:-1] = 0.25 * profile[:, :-2] + 0.5 * profile[:, 1:-1] + 0.25 * profile[:, 2:]
+    return out
+
+def _circle_scores(image, xs, ys, r_min, r_max, n_angles, arcs, smooth=True, dark_prior=False,
+                   enclose=None):
+    """Score every centre (xs[i], ys[i]) against radii r_min..r_max for an
+    outward dark-to-bright circular edge. Returns (scores, radii) with scores
+    shaped (len(xs), len(radii)); higher is better, -inf means excluded.
+
+    With several arcs the edge must show up on each of them: the score is the
+    weakest arc's. With ``dark_prior`` the edge is divided by how much brighter
+    the annulus just inside it is than the darkest such annulus among all
+    candidates (plus DARK_BIAS), so the darkest disk wins over a stronger edge
+    around a brighter one. ``enclose`` (a Circle) drops candidates that do not
+    contain it with a 2 px margin."""
+    r_min = max(1, int(r_min))
+    r_max = int(r_max)
+    if r_max <= r_min:
+        r_max = r_min + 1
+    h, w = image.shape
+    # one extra radius on each side so the radial derivative covers [r_min, r_max];
+    # the dark prior needs every ring from radius 1 for the inner annulus
+    lo = 1 if dark_prior else max(1, r_min - 1)
+    dy, dx = circle_lut(lo, r_max + 1, n_angles, arcs)
+    splits = np.cumsum(arc_sizes(n_angles, arcs))[:-1]
+    radii = np.arange(r_min, r_max + 1)
+    first = r_min - lo
+    if dark_prior:
+        # inner annulus of radius r: rings r // 2 .. r - 1 (the edge ring itself is blurred)
+        ring_weight = np.arange(lo, r_max + 2, dtype=np.float32)   # circumference ~ r
+        cum_weight = np.concatenate(([0.0], np.cumsum(ring_weight)))
+        ann_hi = np.maximum(radii - 1, 1) - lo + 1
+        ann_lo = np.minimum(np.maximum(radii // 2, 1), radii - 1).clip(min=1) - lo
+        ann_weight = cum_weight[ann_hi] - cum_weight[ann_lo]
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+
+    edges, inners = [], []
+    for start in range(0, len(xs), CENTER_CHUNK):
+        cx = xs[start:start + CENTER_CHUNK, None, None]
+        cy = ys[start:start + CENTER_CHUNK, None, None]
+        yy = np.clip(cy + dy, 0, h - 1)
+        xx = np.clip(cx + dx, 0, w - 1)
+        samples = image[yy, xx]                     # (N, R, A)
+        deriv = None
+        for arc in np.split(samples, splits, axis=2):
+            arc_deriv = np.diff(arc.mean(axis=2), axis=1)   # jump between r and r+1
+            if smooth and arc_deriv.shape[1] >= 3:
+                arc_deriv = _smooth_radial(arc_deriv)
+            deriv = arc_deriv if deriv is None else np.minimum(deriv, arc_deriv)
+        # deriv[:, k] is the edge just outside radius lo + k
+        deriv = deriv[:, first:first + len(radii)]
+        if enclose is not None:
+            dist = np.hypot(cx[:, :, 0] - enclose.x, cy[:, :, 0] - enclose.y)
+            deriv = np.where(radii[None, :] >= enclose.r + dist + 2, deriv, -np.inf)
+        edges.append(deriv)
+        if dark_prior:
+            means = samples.mean(axis=2)            # (N, R)
+            cum = np.concatenate((np.zeros((len(means), 1), np.float32),
+                                  np.cumsum(means * ring_weight, axis=1)), axis=1)
+            inners.append((cum[:, ann_hi] - cum[:, ann_lo]) / ann_weight)
+
+    scores = np.concatenate(edges)
+    if dark_prior:
+        inner = np.concatenate(inners)
+        scores = scores / (inner - inner.min() + DARK_BIAS)
+    return scores, radii
+
+def _best_circle(image, xs, ys, r_min, r_max, n_angles, arcs, **options):
+    """(Circle, score) of the best candidate from _circle_scores, or (None, -inf)
+    if every candidate was excluded."""
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+    scores, radii = _circle_scores(image, xs, ys, r_min, r_max, n_angles, arcs, **options)
+    idx = int(np.argmax(scores))
+    score = float(scores.flat[idx])
+    if score == -np.inf:
+        return None, score
+    n, k = divmod(idx, scores.shape[1])
+    return Circle(int(xs[n]), int(ys[n]), int(radii[k])), score
+
+def _grid(x_min, x_max, y_min, y_max, shape):
+    h, w = shape
+    x_min, x_max = max(0, int(x_min)), min(w - 1, int(x_max))
+    y_min, y_max = max(0, int(y_min)), min(h - 1, int(y_max))
+    if x_max < x_min:
+        x_min = x_max = min(max(0, x_min), w - 1)
+    if y_max < y_min:
+        y_min = y_max = min(max(0, y_min), h - 1)
+    gy, gx = np.mgrid[y_min:y_max + 1, x_min:x_max + 1]
+    return gx.ravel(), gy.ravel()
+
+def _pupil_candidates(image, n_angles, count=PUPIL_CANDIDATES):
+    """Best pupil circles on ``image``, strongest first, at least three minimum
+    radii apart so one dark blob does not fill every slot."""
+    side = min(image.shape)
+    # radius 1 rings are mostly noise and specular highlights
+    r_lo = max(2, int(side * PUPIL_RADIUS_FRAC[0]))
+    r_hi = int(side * PUPIL_RADIUS_FRAC[1])
+    h, w = image.shape
+    xs, ys = _grid(r_lo, w - 1 - r_lo, r_lo, h - 1 - r_lo, image.shape)
+    scores, radii = _circle_scores(image, xs, ys, r_lo, r_hi, n_angles, QUADRANTS,
+                                   dark_prior=True)
+    best_r = scores.argmax(axis=1)
+    best = scores[np.arange(len(xs)), best_r]
+    candidates = []
+    for i in np.argsort(-best):
+        if all((xs[i] - c.x) ** 2 + (ys[i] - c.y) ** 2 > (3 * r_lo) ** 2 for c in candidates):
+            candidates.append(Circle(int(xs[i]), int(ys[i]), int(radii[best_r[i]])))
+            if len(candidates) == count:
+                break
+    return candidates
+
+def pupil_contrast(image, pupil, n_angles=N_ANGLES):
+    """How convincingly ``pupil`` is a dark disk inside a brighter ring: the
+    weakest quadrant's (ring r+2..1.5r minus disk r/2..r-1) difference, divided
+    by the disk intensity plus DARK_BIAS. Comparable between candidates, unlike
+    the search scores, which are relative to the darkest candidate seen."""
+    r = max(2, pupil.r)
+    in_lo, in_hi = max(1, r // 2), r - 1
+    out_lo, out_hi = r + 2, r + max(2, r // 2)
+    dy, dx = circle_lut(1, out_hi, n_angles, QUADRANTS)
+    h, w = image.shape
+    samples = image[np.clip(pupil.y + dy, 0, h - 1), np.clip(pupil.x + dx, 0, w - 1)]
+    splits = np.cumsum(arc_sizes(n_angles, QUADRANTS))[:-1]
+    inner = samples[in_lo - 1:in_hi].mean()
+    weakest = min(q[out_lo - 1:out_hi].mean() - q[in_lo - 1:in_hi].mean()
+                  for q in np.split(samples, splits, axis=1))
+    return float(weakest / (inner + DARK_BIAS))
+
+def _search_pupil(image, n_angles):
+    candidates = _pupil_candidates(image, n_angles)
+    return max(candidates, key=lambda c: pupil_contrast(image, c, n_angles))
+
+def _iris_radius_range(image, pupil):
+    # at least two rings clear of the pupil edge, which is blurred on small levels
+    r_lo = max(int(np.ceil(pupil.r / PUPIL_IRIS_RATIO[1])), pupil.r + 2)
+    r_hi = int(pupil.r / PUPIL_IRIS_RATIO[0])
+    return r_lo, max(r_lo + 1, min(r_hi, max(image.shape) // 2))
+
+def _inside_pupil(xs, ys, pupil):
+    # the limbus is not exactly concentric with the pupil, but its centre
+    # lies within the inner half of the pupil disk
+    keep = (xs - pupil.x) ** 2 + (ys - pupil.y) ** 2 <= max(1, pupil.r // 2) ** 2
+    if not keep.any():
+        return np.array([pupil.x]), np.array([pupil.y])
+    return xs[keep], ys[keep]
+
+def _search_iris(image, pupil, n_angles):
+    r_lo, r_hi = _iris_radius_range(image, pupil)
+    offset = max(1, pupil.r // 2)
+    xs, ys = _grid(pupil.x - offset, pupil.x + offset,
+                   pupil.y - offset, pupil.y + offset, image.shape)
+    xs, ys = _inside_pupil(xs, ys, pupil)
+    # dark-to-bright only (iris darker than sclera), and the circle must contain
+    # the pupil, so the pupil edge seen from an off-centre point cannot win
+    iris = _best_circle(image, xs, ys, r_lo, r_hi, n_angles, LATERAL_ARCS, enclose=pupil)[0]
+    return iris or Circle(pupil.x, pupil.y, r_lo)
+
+def _refine(image, circle, n_angles, arcs, r_bounds=None, pupil=None, dark_prior=False,
+            window=REFINE_WINDOW):
+    xs, ys = _grid(circle.x - window, circle.x + window,
+                   circle.y - window, circle.y + window, image.shape)
+    if pupil is not None:
+        xs, ys = _inside_pupil(xs, ys, pupil)
+    r_lo, r_hi = circle.r - window, circle.r + window
+    if r_bounds:
+        # keep the limbus from collapsing onto the pupil edge in a local window
+        r_lo, r_hi = max(r_lo, r_bounds[0]), min(r_hi, r_bounds[1])
+    best = _best_circle(image, xs, ys, r_lo, r_hi, n_angles, arcs, smooth=False,
+                        dark_prior=dark_prior, enclose=pupil)[0]
+    return best or circle
+
+def _rescale(circle, src_shape, dst_shape):
+    # per-axis ratio of the real level shapes: odd sizes and the resampled top
+    # level are not exact factors of two
+    sy = dst_shape[0] / float(src_shape[0])
+    sx = dst_shape[1] / float(src_shape[1])
+    return Circle(int(round(circle.x * sx)), int(round(circle.y * sy)),
+                  int(round(circle.r * (sx + sy) / 2)))
+
+def segment_iris(image, coarse_size=COARSE_SIZE, n_angles=N_ANGLES):
+    """Locate the pupil and limbus boundaries of a grayscale image.
+
+    Exhaustive search on the coarsest pyramid level, then each finer level
+    only re-scores a (2 * REFINE_WINDOW + 1)^3 neighbourhood of the previous
+    estimate, for each of the PUPIL_CANDIDATES pupil hypotheses. Returns (pupil, iris) as Circles in full-resolution pixels.
+    """
+    pyramid = build_pyramid(image, coarse_size)
+    # every pupil candidate is refined down to full resolution (path[i] is its
+    # estimate on pyramid[i]); the most convincing one there wins
+    paths = []
+    for pupil in _pupil_candidates(pyramid[-1], n_angles):
+        path = [pupil]
+        for prev, level in zip(pyramid[:0:-1], pyramid[-2::-1]):
+            path.append(_refine(level, _rescale(path[-1], prev.shape, level.shape), n_angles,
+                                QUADRANTS, dark_prior=True))
+        paths.append(path[::-1])
+    path = max(paths, key=lambda p: pupil_contrast(pyramid[0], p[0], n_angles))
+
+    iris = _search_iris(pyramid[-1], path[-1], n_angles)
+    for i in range(len(pyramid) - 2, -1, -1):
+        level, pupil = pyramid[i], path[i]
+        iris = _refine(level, _rescale(iris, pyramid[i + 1].shape, level.shape), n_angles,
+                       LATERAL_ARCS, r_bounds=_iris_radius_range(level, pupil), pupil=pupil)
+    return path[0], iris
+
+def segment_iris_bruteforce(image, n_angles=N_ANGLES):
+    """Single-level exhaustive search at full resolution. Only meant as the
+    baseline for benchmark_segmentation; cost grows with the 4th power of size."""
+    image = np.asarray(image, dtype=np.float32)
+    pupil = _search_pupil(image, n_angles)
+    iris = _search_iris(image, pupil, n_angles)
+    return pupil, iris
+
+def segment_iris_file(path, coarse_size=COARSE_SIZE, n_angles=N_ANGLES):
+    return segment_iris(load_grayscale(path), coarse_size, n_angles)
+
+
+# ------------------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------------------
+
+def _time_call(fn, image, repeats):
+    best = None
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn(image)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def benchmark_segmentation(path, sides=(256, 512, 1024, 2048, 4096),
+                           repeats=3, bruteforce_max_side=256):
+    """Time segment_iris on ``path`` rescaled to each longer-side length in
+    ``sides``; the brute-force baseline is only run up to ``bruteforce_max_side``."""
+    rows = []
+    print(f"Segmentation benchmark: {path}")
+    print(f"{'size':>12} {'levels':>6} {'top':>8} {'pyramid ms':>11} {'brute ms':>10}  pupil / iris")
+    for side in sides:
+        image = load_grayscale(path, max_side=side)
+        # load_grayscale only shrinks, upscale explicitly for larger targets
+        if max(image.shape) < side:
+            scale = side / float(max(image.shape))
+            im = Image.fromarray(image).resize(
+                (round(image.shape[1] * scale), round(image.shape[0] * scale)), Image.BILINEAR)
+            image = np.asarray(im, dtype=np.float32)
+        pyramid = build_pyramid(image)
+        levels = len(pyramid)
+        top = f"{pyramid[-1].shape[1]}x{pyramid[-1].shape[0]}"
+        t_pyr, (pupil, iris) = _time_call(segment_iris, image, repeats)
+        t_brute = None
+        if max(image.shape) <= bruteforce_max_side:
+            t_brute, _ = _time_call(segment_iris_bruteforce, image, 1)
+        size = f"{image.shape[1]}x{image.shape[0]}"
+        brute = f"{t_brute * 1000:10.1f}" if t_brute is not None else f"{'-':>10}"
+        print(f"{size:>12} {levels:>6} {top:>8} {t_pyr * 1000:11.1f} {brute}  {tuple(pupil)} / {tuple(iris)}")
+        rows.append((size, levels, t_pyr, t_brute, pupil, iris))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark coarse-to-fine iris segmentation.")
+    parser.add_argument('image', nargs='?', default=os.path.join('uploads', 'user-1.jpg'))
+    parser.add_argument('--sides', type=int, nargs='+', default=[256, 512, 1024, 2048, 4096])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--bruteforce-max-side', type=int, default=256)
+    args = parser.parse_args()
+    benchmark_segmentation(args.image, args.sides, args.repeats, args.bruteforce_max_side)
@@ -0,0 +1,222 @@
+"""
+test_admission_control.py
+
+Token buckets (with a fake clock), slot waiting, the bounded wait queue and
+the Flask guard of admission_control.MemoryBackend / AdmissionController.
+"""
+
+import threading
+import time
+
+import pytest
+
+from admission_control import AdmissionController, AdmissionRejected, MemoryBackend
+
+flask = pytest.importorskip('flask')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# ------------------------------------------------------------------------------
+# MemoryBackend
+# ------------------------------------------------------------------------------
+
+def test_consume_allows_burst_then_reports_wait():
+    clock = FakeClock()
+    backend = MemoryBackend(clock=clock)
+    assert [backend.consume('k', 0.5, 3) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.consume('k', 0.5, 3) == pytest.approx(2.0)
+    clock.now += 2.0
+    assert backend.consume('k', 0.5, 3) == 0.0
+    assert backend.consume('k', 0.5, 3) > 0
+
+
+def test_sweep_drops_refilled_buckets():
+    clock = FakeClock()
+    backend = MemoryBackend(sweep_interval=5.0, clock=clock)
+    for i in range(50):
+        backend.consume(f'k{i}', 1.0, 2)
+    assert len(backend.buckets) == 50
+    clock.now += 5.0
+    backend.consume('fresh', 1.0, 2)
+    assert list(backend.buckets) == ['fresh']
+
+
+def test_bucket_table_is_capped_least_recently_used_first():
+    backend = MemoryBackend(max_buckets=3, clock=FakeClock())
+    for key in ('a', 'b', 'c'):
+        backend.consume(key, 1.0, 5)
+    backend.consume('a', 1.0, 5)
+    backend.consume('d', 1.0, 5)
+    assert list(backend.buckets) == ['c', 'a', 'd']
+
+
+def test_wait_for_slot_wakes_on_release():
+    backend = MemoryBackend()
+    token = backend.try_acquire_slot(1)
+    assert backend.try_acquire_slot(1) is None
+    threading.Timer(0.05, backend.release_slot, args=(token,)).start()
+    t0 = time.monotonic()
+    assert backend.wait_for_slot(1, 5.0)
+    assert time.monotonic() - t0 < 1.0
+    assert backend.in_flight() == 1
+
+
+def test_wait_for_slot_times_out():
+    backend = MemoryBackend()
+    backend.try_acquire_slot(1)
+    assert backend.wait_for_slot(1, 0.05) is None
+
+
+# ------------------------------------------------------------------------------
+# AdmissionController
+# ------------------------------------------------------------------------------
+
+def test_acquire_queues_then_sheds_with_503():
+    ctrl = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    ctrl.acquire()
+    waiter = threading.Thread(target=lambda: pytest.raises(AdmissionRejected, ctrl.acquire))
+    waiter.start()
+    deadline = time.monotonic() + 1.0
+    while ctrl.backend.queue_depth() == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    # queue full: rejected at once
+    with pytest.raises(AdmissionRejected) as exc:
+        ctrl.acquire()
+    assert exc.value.status == 503
+    waiter.join()
+    stats = ctrl.stats()
+    assert stats['rejected_overload'] == 1
+    assert stats['rejected_queue_timeout'] == 1
+    assert stats['queue_depth'] == 0
+    assert stats['in_flight'] == 1
+
+
+def test_queued_request_gets_released_slot():
+    ctrl = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5.0)
+    token = ctrl.acquire()
+    threading.Timer(0.05, ctrl.release, args=(token,)).start()
+    assert ctrl.acquire()
+    assert ctrl.stats()['queued_total'] == 1
+
+
+def test_rate_check_raises_429_with_retry_after():
+    ctrl = AdmissionController(backend=MemoryBackend(clock=FakeClock()), user_rate=0.5, user_burst=1)
+    ctrl.check_rate('user', 'alice')
+    with pytest.raises(AdmissionRejected) as exc:
+        ctrl.check_rate('user', 'alice')
+    assert exc.value.status == 429
+    assert exc.value.retry_after == pytest.approx(2.0)
+
+
+# ------------------------------------------------------------------------------
+# guard
+# ------------------------------------------------------------------------------
+
+def make_app(ctrl, view=None, account_kind='user'):
+    app = flask.Flask(__name__)
+
+    @app.route('/login', methods=['POST'])
+    @ctrl.guard(lambda: flask.request.remote_addr, lambda: flask.request.form.get('username'),
+                account_kind=account_kind)
+    def login():
+        return view() if view else 'ok'
+
+    return app
+
+
+def post(app, username='alice', addr='10.0.0.1'):
+    return app.test_client().post('/login', data={'username': username},
+                                  environ_base={'REMOTE_ADDR': addr})
+
+
+def test_guard_rate_limits_account_with_retry_after():
+    ctrl = AdmissionController(user_rate=0.1, user_burst=2, client_burst=100)
+    app = make_app(ctrl)
+    assert [post(app, addr=f'10.0.0.{i}').status_code for i in range(3)] == [200, 200, 429]
+    resp = post(app, addr='10.0.0.9')
+    assert resp.headers['Retry-After'] == '10'
+    # other accounts are unaffected
+    assert post(app, username='bob').status_code == 200
+
+
+def test_guard_rate_limits_client():
+    ctrl = AdmissionController(client_rate=0.1, client_burst=2, user_burst=100)
+    app = make_app(ctrl)
+    assert [post(app, username=f'u{i}').status_code for i in range(3)] == [200, 200, 429]
+    assert ctrl.stats()['rejected_client_rate'] == 1
+
+
+def test_guard_account_kinds_do_not_share_buckets():
+    ctrl = AdmissionController(user_rate=0.1, user_burst=1, client_burst=100)
+    admin = make_app(ctrl, account_kind='admin')
+    user = make_app(ctrl)
+    assert post(admin, username='admin').status_code == 200
+    assert post(admin, username='admin').status_code == 429
+    assert post(user, username='admin').status_code == 200
+
+
+def test_guard_caps_in_flight_and_sheds_overflow():
+    release = threading.Event()
+    ctrl = AdmissionController(max_in_flight=2, max_queue=2, queue_timeout=0.5,
+                               client_burst=100, user_burst=100)
+    app = make_app(ctrl, view=lambda: (release.wait(5), 'ok')[1])
+    statuses = []
+
+    def worker(i):
+        statuses.append(post(app, username=f'u{i}', addr=f'10.0.1.{i}').status_code)
+
+    holders = [threading.Thread(target=worker, args=(i,)) for i in range(2)]
+    for t in holders:
+        t.start()
+    while ctrl.backend.in_flight() < 2:
+        time.sleep(0.001)
+    others = [threading.Thread(target=worker, args=(i,)) for i in range(2, 6)]
+    for t in others:
+        t.start()
+    for t in others:
+        t.join()
+    release.set()
+    for t in holders:
+        t.join()
+    assert sorted(statuses) == [200, 200, 503, 503, 503, 503]
+    stats = ctrl.stats()
+    assert stats['rejected_overload'] == 2
+    assert stats['rejected_queue_timeout'] == 2
+    assert stats['in_flight'] == 0
+
+
+def test_guard_checks_rates_before_queueing():
+    release = threading.Event()
+    ctrl = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=5.0,
+                               user_rate=0.01, user_burst=1, client_burst=100)
+    app = make_app(ctrl, view=lambda: (release.wait(5), 'ok')[1])
+    holder = threading.Thread(target=post, args=(app,))
+    holder.start()
+    while ctrl.backend.in_flight() < 1:
+        time.sleep(0.001)
+    t0 = time.monotonic()
+    assert post(app, addr='10.0.0.2').status_code == 429
+    assert time.monotonic() - t0 < 1.0
+    assert 'queued_total' not in ctrl.stats()
+    release.set()
+    holder.join()
+
+
+def test_guard_passes_get_through():
+    ctrl = AdmissionController(client_burst=1)
+    app = flask.Flask(__name__)
+
+    @app.route('/login', methods=['GET', 'POST'])
+    @ctrl.guard(lambda: 'same', lambda: None)
+    def login():
+        return 'form'
+
+    client = app.test_client()
+    assert [client.get('/login').status_code for _ in range(3)] == [200, 200, 200]
@@ -0,0 +1,108 @@
+"""
+test_iris_app.py
+
+Multi-file upload and zip download of a user's files, through the Flask test
+client. Uploads and users.json go to a temporary directory.
+"""
+
+import importlib
+import io
+import sys
+import types
+import zipfile
+
+import pytest
+
+pytest.importorskip('flask')
+
+# The desktop window and the docx converter are not used by these routes; only
+# fill in placeholders where the packages are not installed
+for _name, _attrs in (('webview', {'windows': []}), ('docx2pdf', {'convert': None})):
+    try:
+        importlib.import_module(_name)
+    except ImportError:
+        sys.modules[_name] = types.SimpleNamespace(**_attrs)
+
+import iris_app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(iris_app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(iris_app, 'USER_DATA_FILE', str(tmp_path / 'users.json'))
+    monkeypatch.setattr(iris_app, 'USERS', {
+        'alice': {'name': 'Alice', 'iris_path': 'alice.jpg', 'files': []},
+        'bob': {'name': 'Bob', 'iris_path': 'bob.jpg', 'files': [('bob.txt', 3)]},
+    })
+    (tmp_path / 'bob.txt').write_bytes(b'bob')
+    c = iris_app.app.test_client()
+    with c.session_transaction() as sess:
+        sess['user_logged_in'] = True
+        sess['username'] = 'alice'
+    return c
+
+
+def upload(client, *files):
+    data = {'file': [(io.BytesIO(content), name) for name, content in files]}
+    return client.post('/user_upload_file', data=data, content_type='multipart/form-data')
+
+
+def read_zip(resp):
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/zip'
+    zf = zipfile.ZipFile(io.BytesIO(resp.get_data()))
+    assert zf.testzip() is None
+    return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_upload_many_files_saves_each_and_writes_metadata_once(client, tmp_path, monkeypatch):
+    saves = []
+    real_save = iris_app.save_users_to_json
+    monkeypatch.setattr(iris_app, 'save_users_to_json', lambda: (saves.append(1), real_save()))
+
+    big = bytes(range(256)) * 1024
+    resp = upload(client, ('a.txt', b'hello'), ('big.bin', big), ('empty.txt', b''))
+
+    assert resp.status_code == 302
+    assert len(saves) == 1
+    assert iris_app.USERS['alice']['files'] == [('a.txt', 5), ('big.bin', len(big)), ('empty.txt', 0)]
+    assert (tmp_path / 'big.bin').read_bytes() == big
+    assert (tmp_path / 'empty.txt').read_bytes() == b''
+
+
+def test_upload_without_files_changes_nothing(client):
+    resp = client.post('/user_upload_file', data={}, content_type='multipart/form-data')
+    assert resp.status_code == 302
+    assert iris_app.USERS['alice']['files'] == []
+
+
+def test_reupload_replaces_existing_entry(client):
+    upload(client, ('a.txt', b'first'))
+    upload(client, ('a.txt', b'second!'))
+    assert iris_app.USERS['alice']['files'] == [('a.txt', 7)]
+
+
+def test_download_all_streams_every_owned_file(client):
+    upload(client, ('a.txt', b'hello'), ('empty.txt', b''))
+    resp = client.get('/download_files')
+    assert resp.is_streamed
+    assert read_zip(resp) == {'a.txt': b'hello', 'empty.txt': b''}
+
+
+def test_download_selection_skips_files_the_user_does_not_own(client):
+    upload(client, ('a.txt', b'hello'), ('b.txt', b'world'))
+    resp = client.post('/download_files', data={'filenames': ['b.txt', 'bob.txt', '../users.json']})
+    assert read_zip(resp) == {'b.txt': b'world'}
+
+
+def test_download_selection_of_only_foreign_files_redirects(client):
+    upload(client, ('a.txt', b'hello'))
+    resp = client.post('/download_files', data={'filenames': ['bob.txt']})
+    assert resp.status_code == 302
+
+
+def test_download_requires_login(client):
+    with client.session_transaction() as sess:
+        sess.clear()
+    resp = client.get('/download_files')
+    assert resp.status_code == 302
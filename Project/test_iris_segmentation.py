@@ -0,0 +1,83 @@
+"""
+test_iris_segmentation.py
+
+Synthetic eyes (dark pupil disk inside an iris disk on a bright background)
+must come back with both circles within a few pixels, and the pupil of the
+real sample photo uploads/user-1.jpg must be found at every benchmark size.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from iris_segmentation import (
+    build_pyramid, load_grayscale, segment_iris, segment_iris_bruteforce, COARSE_SIZE
+)
+
+TOLERANCE = 3
+
+USER_1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'user-1.jpg')
+# measured by hand on the full 4144x2480 image
+USER_1_WIDTH = 4144
+USER_1_PUPIL = (1712, 1278, 79)
+
+
+def synthetic_eye(shape, pupil, iris, levels, noise=0.0, seed=0):
+    # pupil / iris are (x, y, r); levels are pupil, iris, sclera intensities
+    h, w = shape
+    yy, xx = np.mgrid[:h, :w]
+    img = np.full(shape, levels[2], dtype=np.float32)
+    img[np.hypot(xx - iris[0], yy - iris[1]) < iris[2]] = levels[1]
+    img[np.hypot(xx - pupil[0], yy - pupil[1]) < pupil[2]] = levels[0]
+    if noise:
+        img += np.random.default_rng(seed).normal(0, noise, shape).astype(np.float32)
+    return img
+
+
+def assert_close(found, expected):
+    assert found is not None
+    for got, want in zip(found, expected):
+        assert abs(got - want) <= TOLERANCE, (tuple(found), expected)
+
+
+@pytest.mark.parametrize('shape, pupil, iris, levels, noise', [
+    # limbus edge stronger than the pupil edge
+    ((480, 640), (320, 240, 30), (320, 240, 100), (20, 100, 210), 0),
+    ((1024, 1024), (512, 512, 60), (512, 512, 200), (20, 100, 210), 0),
+    # pupil edge stronger than the limbus edge
+    ((480, 640), (300, 250, 30), (300, 250, 100), (10, 120, 180), 0),
+    # limbus not concentric with the pupil, noisy
+    ((600, 800), (410, 290, 45), (402, 296, 150), (25, 90, 200), 8),
+    ((153, 256), (105, 79, 8), (105, 79, 30), (20, 100, 210), 0),
+])
+def test_segment_iris_recovers_both_circles(shape, pupil, iris, levels, noise):
+    img = synthetic_eye(shape, pupil, iris, levels, noise)
+    found_pupil, found_iris = segment_iris(img)
+    assert_close(found_pupil, pupil)
+    assert_close(found_iris, iris)
+
+
+def test_bruteforce_recovers_both_circles():
+    img = synthetic_eye((240, 320), (160, 120, 15), (160, 120, 50), (20, 100, 210))
+    found_pupil, found_iris = segment_iris_bruteforce(img)
+    assert_close(found_pupil, (160, 120, 15))
+    assert_close(found_iris, (160, 120, 50))
+
+
+@pytest.mark.parametrize('shape', [(480, 640), (1024, 1024), (2451, 4096), (64, 64)])
+def test_pyramid_top_level_has_fixed_size(shape):
+    top = build_pyramid(np.zeros(shape, dtype=np.float32))[-1]
+    assert min(top.shape) == COARSE_SIZE
+
+
+@pytest.mark.parametrize('side', [256, 512, 1024, 2048, 4096])
+def test_segment_iris_finds_pupil_in_sample_photo(side):
+    # the dark inner eye corner next to the eye is the trap here
+    img = load_grayscale(USER_1, max_side=side)
+    scale = img.shape[1] / float(USER_1_WIDTH)
+    pupil, _ = segment_iris(img)
+    # a few pixels at 1024 px width, scaled with the image
+    tolerance = TOLERANCE * max(1.0, img.shape[1] / 1024.0)
+    for got, want in zip(pupil, USER_1_PUPIL):
+        assert abs(got - want * scale) <= tolerance, (tuple(pupil), side)